@@ -1,31 +1,121 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
-import re, json, shutil, datetime
+import io, os, re, csv, json, math, time, string, shutil, tarfile, functools, argparse, hashlib, datetime
+from concurrent.futures import ProcessPoolExecutor
+from itertools import chain, repeat
+from operator import itemgetter
 from pathlib import Path
-import pandas as pd
+import numpy as np
+try:
+    import pyarrow as pa  # fast path for large CSVs + Parquet cache (optional)
+    import pyarrow.csv as pacsv
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+try:
+    from numba import njit  # fused classify kernel (optional)
+except ImportError:
+    njit = None
 
 # ---------- Paths & Config ----------
 ROOT = Path(__file__).resolve().parents[1]
 DATA_DIR = ROOT / "Data"
 DIST = ROOT / "dist"
+CACHE_DIR = ROOT / ".cache"
+BUNDLE = ROOT / "site.tar"  # --bundle output
+MANIFEST = CACHE_DIR / "build" / "manifest.json"  # stock dir → stock_hash() of its last render
+TEMPLATE_VERSION = 2  # bump whenever tpl_base or the stock page body changes
 
 CFG = json.loads((ROOT / "config.json").read_text(encoding="utf-8"))
 BASE_URL = CFG.get("base_url", "").rstrip("/")  # e.g. https://anandsolanke.github.io/stockpricepredictions-ssg
 
+# ---------- HTML escaping ----------
+_HTML_TRANS = str.maketrans({"&": "&amp;", "<": "&lt;", ">": "&gt;", '"': "&quot;", "'": "&#39;"})
+
+def esc(s: str):
+    """HTML-escape text (one C-level pass via str.translate)."""
+    return s.translate(_HTML_TRANS)
+
+def esc_rows(rows):
+    """HTML-escaped copy of each row's text fields: one str.translate per column, not per cell."""
+    if not rows:
+        return []
+    cols = []
+    for c in TEXT_COLS:
+        joined = "\x00".join([r[c] for r in rows])
+        if joined.count("\x00") != len(rows) - 1:
+            # a cell holds NUL itself, so the separator is ambiguous: escape cell by cell
+            return [{c: esc(r[c]) for c in TEXT_COLS} for r in rows]
+        cols.append(joined.translate(_HTML_TRANS).split("\x00"))
+    return [dict(zip(TEXT_COLS, vals)) for vals in zip(*cols)]
+
+# ---------- Page shell (build-invariant parts bound once) ----------
+def _const(s):
+    """Config text → HTML-escaped literal, safe to embed in a str.format template."""
+    return esc(str(s)).replace("{", "{{").replace("}", "}}")
+
+_SITE_TITLE = esc(CFG.get("site_title", ""))
+_META_KW = _const(", ".join(CFG.get("keywords", [])))
+_AUTHOR_NAME = _const(CFG.get("author", {}).get("name", ""))
+_AUTHOR_ORG = _const(CFG.get("author", {}).get("org", ""))
+_AUTHOR_EMAIL = _const(CFG.get("author", {}).get("contact_email", ""))
+_SITE_TAGLINE = _const(CFG.get("site_tagline", ""))
+_BASE = _const(BASE_URL)
+_CSS_URL = f"{_BASE}/static/styles.css"
+_BUILD_TIME = datetime.datetime.utcnow().isoformat(timespec="seconds") + "Z"
+
+_PAGE_TMPL = f"""<!doctype html>
+<html lang="en">
+<head>
+<meta charset="utf-8">
+<meta name="viewport" content="width=device-width,initial-scale=1">
+<title>{{title}}</title>
+<link rel="canonical" href="{{canonical}}">
+<meta name="description" content="{{description}}">
+<meta name="keywords" content="{_META_KW}">
+<meta name="author" content="{_AUTHOR_NAME}">
+<link rel="stylesheet" href="{_CSS_URL}">
+</head>
+<body>
+<div class="container">
+<header class="hero card">
+  <div class="breadcrumbs"><a href="{_BASE}/index.html">Home</a></div>
+  <h1 class="h1">{{title}}</h1>
+  <p class="small">{_SITE_TAGLINE}</p>
+  <div class="kv">
+    <div><strong>Purpose:</strong> Transparent, reproducible SSG for daily stock pages.</div>
+    <div><strong>Last build:</strong> {_BUILD_TIME}</div>
+  </div>
+</header>
+<main class="grid">
+{{body}}
+</main>
+<footer class="footer">
+  <div>E-E-A-T: Author <strong>{_AUTHOR_NAME}</strong> · Org: {_AUTHOR_ORG} · Contact: <a href="mailto:{_AUTHOR_EMAIL}">{_AUTHOR_EMAIL}</a></div>
+  <div>Data provenance: Uploaded CSVs (OHLC). Session date = exchange local date. Prediction = next business day (holidays not applied).</div>
+</footer>
+</div>
+</body>
+</html>"""
+
 # ---------- Helpers ----------
+_DATE_RE = re.compile(r"^(\d{2})\.(\d{2})\.(\d{4})$")
+
 def find_latest_date_folder():
     """Find latest Data/DD.MM.YYYY folder."""
     if not DATA_DIR.exists():
         raise SystemExit("Missing Data/ directory at repo root.")
     candidates = []
-    for p in DATA_DIR.iterdir():
-        if p.is_dir() and re.match(r"^\d{2}\.\d{2}\.\d{4}$", p.name):
-            d = datetime.datetime.strptime(p.name, "%d.%m.%Y").date()
-            candidates.append((d, p))
+    with os.scandir(DATA_DIR) as it:
+        for entry in it:
+            m = _DATE_RE.match(entry.name)
+            if m and entry.is_dir():
+                d = datetime.date(int(m[3]), int(m[2]), int(m[1]))
+                candidates.append((d, entry.path))
     if not candidates:
         raise SystemExit("No dated folder like DD.MM.YYYY inside Data/.")
-    candidates.sort(key=lambda x: x[0], reverse=True)
-    return candidates[0][1], candidates[0][0]
+    d, p = max(candidates, key=itemgetter(0))
+    return Path(p), d
 
 def next_business_day(d: datetime.date):
     wd = d.weekday()
@@ -35,92 +125,383 @@ def next_business_day(d: datetime.date):
         return d + datetime.timedelta(days=2)
     return d + datetime.timedelta(days=1)
 
+# classify() outcome codes → signal / reason (index = code)
+_SIG_BY_CODE = np.array(["Sideways", "Sideways", "Bullish", "Bearish", "Sideways"])
+_REASON_BY_CODE = np.array(["No range", "Small body vs range — indecision", "Close above open", "Close below open", "Flat"])
+
+if njit is not None:
+    @njit(cache=True)
+    def classify_kernel(o, h, l, c, code, conf):
+        """One fused pass over the OHLC arrays, filling outcome codes + confidences in place."""
+        for i in range(o.shape[0]):
+            rng = abs(h[i]-l[i])
+            body = abs(c[i]-o[i])
+            ratio = body/rng if rng > 0 else 0.0
+            conf[i] = 0.5
+            if rng <= 0: code[i] = 0
+            elif ratio < 0.2: code[i] = 1
+            elif c[i] > o[i]: code[i] = 2; conf[i] = min(0.9, 0.6 + ratio/2)
+            elif c[i] < o[i]: code[i] = 3; conf[i] = min(0.9, 0.6 + ratio/2)
+            else: code[i] = 4
+else:
+    classify_kernel = None
+
 def classify(o,h,l,c):
-    """Simple candle heuristic → (signal, confidence, reason)."""
-    rng = max(h,l) - min(h,l)
-    body = abs(c-o)
-    if rng <= 0: return "Sideways", 0.5, "No range"
-    ratio = body/rng if rng else 0.0
-    if ratio < 0.2: return "Sideways", 0.5, "Small body vs range — indecision"
-    if c > o: return "Bullish", min(0.9, 0.6 + ratio/2), "Close above open"
-    if c < o: return "Bearish", min(0.9, 0.6 + ratio/2), "Close below open"
-    return "Sideways", 0.5, "Flat"
-
-def read_csv_safe(p: Path):
-    df = pd.read_csv(p, low_memory=False)
-    cols = {c: c.strip().lower() for c in df.columns}
-    df = df.rename(columns=cols)
+    """Simple candle heuristic over OHLC arrays → (signal, confidence, reason) arrays."""
+    if classify_kernel is not None:
+        code = np.empty(o.shape[0], dtype=np.int8)
+        conf = np.empty(o.shape[0], dtype=np.float64)
+        classify_kernel(o, h, l, c, code, conf)
+        return _SIG_BY_CODE[code], conf, _REASON_BY_CODE[code]
+    # NumPy fallback
+    rng = np.abs(h-l)
+    body = np.abs(c-o)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        ratio = np.where(rng > 0, body/rng, 0.0)
+    branches = [rng <= 0, ratio < 0.2, c > o, c < o]
+    sig = np.select(branches, ["Sideways", "Sideways", "Bullish", "Bearish"], default="Sideways")
+    trend = ~(branches[0] | branches[1]) & (branches[2] | branches[3])
+    conf = np.where(trend, np.minimum(0.9, 0.6 + ratio/2), 0.5)
+    reason = np.select(branches, ["No range", "Small body vs range — indecision", "Close above open", "Close below open"], default="Flat")
+    return sig, conf, reason
+
+TEXT_COLS = ["symbol","description","exchange","sector","industry"]
+OHLC = ["open","high","low","close"]
+
+ARROW_MIN_BYTES = 1 << 20  # CSVs at least this big take the PyArrow path (when installed)
+
+def _num(v):
+    try:
+        return float(v)
+    except (TypeError, ValueError):
+        return math.nan
+
+def to_float_column(values):
+    """Strings → float64 array, NaN where empty/malformed; a single vectorized cast unless a cell is junk."""
+    arr = np.array(values, dtype=np.str_)
+    arr[arr == ""] = "nan"
+    try:
+        return arr.astype(np.float64)
+    except ValueError:
+        return np.array([_num(v) for v in values], dtype=np.float64)
+
+def read_rows(p: Path):
+    """CSV → (row dicts with lower-cased keys and str text fields, (n, 4) float64 OHLC array)."""
+    if pa is not None and p.stat().st_size >= ARROW_MIN_BYTES:
+        table = read_table_cached(p)
+        if table is not None:
+            cols = [table.column(c).to_pylist() for c in TEXT_COLS]
+            ohlc = np.column_stack([table.column(c).to_numpy() for c in OHLC]).reshape(-1, 4)
+            return [dict(zip(TEXT_COLS, vals)) for vals in zip(*cols)], ohlc
+
+    with open(p, newline="", encoding="utf-8-sig") as f:
+        rows = [{k.strip().lower(): (v or "") for k, v in row.items() if k is not None}
+                for row in csv.DictReader(f)]
     # Ensure required columns exist
-    for c in ["symbol","description","exchange","sector","industry","open","high","low","close"]:
-        if c not in df.columns:
-            df[c] = "" if c not in ["open","high","low","close"] else None
-    return df
+    for row in rows:
+        for c in TEXT_COLS:
+            row.setdefault(c, "")
+    ohlc = np.column_stack([to_float_column([r.get(c, "") for r in rows]) for c in OHLC]).reshape(-1, 4)
+    return rows, ohlc
+
+def read_table_cached(p: Path):
+    """Typed Arrow table of the required columns (Parquet-cached under .cache/ while fresh).
+
+    None if PyArrow cannot type the file (e.g. non-numeric OHLC cells); the csv module handles those.
+    """
+    cache = CACHE_DIR / p.relative_to(ROOT).with_suffix(".parquet")
+    if cache.exists() and cache.stat().st_mtime >= p.stat().st_mtime:
+        return pq.read_table(cache)
+
+    with open(p, newline="", encoding="utf-8-sig") as f:
+        header = next(csv.reader(f), [])
+    by_name = {h.strip().lower(): h for h in header}
+    types = {by_name[c]: pa.string() for c in TEXT_COLS if c in by_name}
+    types.update({by_name[c]: pa.float64() for c in OHLC if c in by_name})
+    try:
+        table = pacsv.read_csv(
+            p,
+            read_options=pacsv.ReadOptions(use_threads=True, block_size=1 << 20),
+            convert_options=pacsv.ConvertOptions(
+                column_types=types, include_columns=list(types), strings_can_be_null=False
+            ),
+        )
+    except pa.ArrowInvalid:
+        return None
+    table = table.rename_columns([h.strip().lower() for h in table.column_names])
+    arrays = []
+    for c in TEXT_COLS + OHLC:
+        if c in table.column_names:
+            col = table.column(c)
+            arrays.append(col.fill_null(math.nan) if c in OHLC else col)
+        else:
+            arrays.append(pa.array([""] * table.num_rows if c in TEXT_COLS else [math.nan] * table.num_rows))
+    table = pa.table(arrays, names=TEXT_COLS + OHLC)
+
+    cache.parent.mkdir(parents=True, exist_ok=True)
+    pq.write_table(table, cache, compression="zstd")
+    return table
+
+def parse_row(raw, shown):
+    """CSV row (raw + HTML-escaped) → (sym, name, exch, sec, ind, slug); slug from the raw name."""
+    sym = shown["symbol"].strip()
+    return (
+        sym,
+        shown["description"].strip() or sym,
+        shown["exchange"].strip(),
+        shown["sector"].strip(),
+        shown["industry"].strip(),
+        slug(raw["description"].strip() or raw["symbol"].strip()),
+    )
+
+_SLUG_RE = re.compile(r"[^a-z0-9]+")
 
+@functools.lru_cache(maxsize=65536)
 def slug(s: str):
     s = (s or "").strip().lower()
-    s = re.sub(r"[^a-z0-9]+", "-", s)
+    s = _SLUG_RE.sub("-", s)
     return s.strip("-") or "stock"
 
+KNOWN_DIRS = set()  # dirs this process already created; skips repeat mkdir/stat calls
+_WRITE_FLAGS = os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, "O_BINARY", 0)
+
+def ensure_dir(d: Path):
+    if d not in KNOWN_DIRS:
+        d.mkdir(parents=True, exist_ok=True)
+        KNOWN_DIRS.add(d)
+
 def write_html(path: Path, html: str):
-    path.parent.mkdir(parents=True, exist_ok=True)
-    path.write_text(html, encoding="utf-8")
+    write_html_bytes(path, html.encode("utf-8"))
+
+TAR = None  # with --bundle: the open site.tar file every output is appended to instead of dist/
+
+def tar_member(path: Path, blob: bytes):
+    """path's tar member as raw bytes (header + data padded to a block), so workers can pre-encode them."""
+    info = tarfile.TarInfo(path.relative_to(DIST).as_posix())
+    info.size, info.mtime, info.mode = len(blob), int(time.time()), 0o644
+    return info.tobuf() + blob + bytes(-len(blob) % tarfile.BLOCKSIZE)
+
+def write_html_bytes(path: Path, blob: bytes):
+    if TAR is not None:
+        TAR.write(tar_member(path, blob))
+        return
+    ensure_dir(path.parent)
+    data = memoryview(blob)
+    fd = os.open(path, _WRITE_FLAGS, 0o644)
+    try:
+        while data:
+            data = data[os.write(fd, data):]
+    finally:
+        os.close(fd)
+
+# Shell pre-split once into (literal, field) runs; pages are assembled by appending, not re-parsed by format()
+_SHELL = [(lit, field) for lit, field, _, _ in string.Formatter().parse(_PAGE_TMPL)]
 
 def tpl_base(title, description, body, canonical):
     """Minimal HTML template (no Jinja) with correct BASE_URL links."""
-    meta_kw = ", ".join(CFG.get("keywords", []))
-    author = CFG.get("author", {})
-    site_tagline = CFG.get("site_tagline", "")
-    build_time = datetime.datetime.utcnow().isoformat(timespec="seconds") + "Z"
-    css = f"{BASE_URL}/static/styles.css"
-    return f"""<!doctype html>
-<html lang="en">
-<head>
-<meta charset="utf-8">
-<meta name="viewport" content="width=device-width,initial-scale=1">
-<title>{title}</title>
-<link rel="canonical" href="{canonical}">
-<meta name="description" content="{description}">
-<meta name="keywords" content="{meta_kw}">
-<meta name="author" content="{author.get('name','')}">
-<link rel="stylesheet" href="{css}">
-</head>
-<body>
-<div class="container">
-<header class="hero card">
-  <div class="breadcrumbs"><a href="{BASE_URL}/index.html">Home</a></div>
-  <h1 class="h1">{title}</h1>
-  <p class="small">{site_tagline}</p>
-  <div class="kv">
-    <div><strong>Purpose:</strong> Transparent, reproducible SSG for daily stock pages.</div>
-    <div><strong>Last build:</strong> {build_time}</div>
-  </div>
-</header>
-<main class="grid">
-{body}
-</main>
-<footer class="footer">
-  <div>E-E-A-T: Author <strong>{author.get('name','')}</strong> · Org: {author.get('org','')} · Contact: <a href="mailto:{author.get('contact_email','')}">{author.get('contact_email','')}</a></div>
-  <div>Data provenance: Uploaded CSVs (OHLC). Session date = exchange local date. Prediction = next business day (holidays not applied).</div>
-</footer>
-</div>
-</body>
-</html>"""
+    fields = {"title": title, "description": description, "body": body, "canonical": canonical}
+    sio = io.StringIO()
+    for lit, field in _SHELL:
+        sio.write(lit)
+        if field:
+            sio.write(fields[field])
+    return sio.getvalue()
+
+# Same shell as prebuilt UTF-8 bytes with %-placeholders (literal '%' doubled first)
+_PAGE_TMPL_B = _PAGE_TMPL.replace("%", "%%").format(
+    title="%(title)s", description="%(description)s", canonical="%(canonical)s", body="%(body)s"
+).encode("utf-8")
+
+def tpl_base_bytes(title, description, body: bytes, canonical):
+    """tpl_base() straight to bytes; body is pre-encoded so pages sharing it encode it once."""
+    return _PAGE_TMPL_B % {
+        b"title": title.encode("utf-8"),
+        b"description": description.encode("utf-8"),
+        b"body": body,
+        b"canonical": canonical.encode("utf-8"),
+    }
+
+
+_CFG_KEY = json.dumps(CFG, sort_keys=True)
+BATCH = 64    # stocks per worker job
+SITEMAP_MAX = 45_000  # URLs per sitemap file (the protocol caps it at 50,000)
+STOCK_PAGES = ("index.html", "prediction/index.html", "tomorrow-prediction/index.html")
+
+def stock_hash(task):
+    """Content key of one stock's pages: its render task + config + template version."""
+    key = "|".join(map(str, (*task, TEMPLATE_VERSION, _CFG_KEY)))
+    return hashlib.blake2b(key.encode("utf-8"), digest_size=16).hexdigest()
+
+@functools.lru_cache(maxsize=1024)
+def prediction_block(sig, pct, reason, session: datetime.date):
+    """Prediction card for one classify() outcome; shared by every stock with that outcome."""
+    pred = next_business_day(session)
+    return f"""  <div class="card">
+    <h3 class="h3">Prediction for {pred.isoformat()}</h3>
+    <p><strong>{sig}</strong> — {reason} (confidence {pct}%).</p>
+  </div>"""
+
+def render_stock(args):
+    """One stock's page and its SEO aliases → [(path, UTF-8 bytes), ...]."""
+    key, stock_url, sym, name, exch, o, h, l, c, sig, conf, reason, region_name, country_name, date_obj = args
+    pred = prediction_block(sig, int(conf*100), reason, date_obj)
+
+    # Base stock page
+    stock_body = f"""
+<article class="card">
+  <h2 class="h2">{name} ({sym})</h2>
+  <p class="small">Region: {region_name} · Country: {country_name} · Exchange: {exch}</p>
+  <p class="small">Session Date: {date_obj.isoformat()} · OHLC: O {o}, H {h}, L {l}, C {c}</p>
+{pred}
+</article>"""
+
+    body = stock_body.encode("utf-8")
+    stock_dir = DIST / key
+    stock_url += "/"
+    return [
+        (stock_dir / "index.html", tpl_base_bytes(
+            f"{name} prediction tomorrow — {_SITE_TITLE}",
+            f"{name} ({sym}) next-day prediction and OHLC snapshot.",
+            body,
+            stock_url
+        )),
+        # ---- SEO aliases ----
+        # /prediction/
+        (stock_dir / "prediction" / "index.html", tpl_base_bytes(
+            f"{name} prediction — {_SITE_TITLE}",
+            f"{name} ({sym}) prediction based on yesterday’s OHLC.",
+            body,
+            f"{stock_url}prediction/"
+        )),
+        # /tomorrow-prediction/
+        (stock_dir / "tomorrow-prediction" / "index.html", tpl_base_bytes(
+            f"{name} tomorrow prediction — {_SITE_TITLE}",
+            f"{name} ({sym}) forecast for the next trading day.",
+            body,
+            f"{stock_url}tomorrow-prediction/"
+        )),
+    ]
+
+def render_batch(tasks, bundle=False):
+    """Worker: render + write a batch of stocks.
+
+    With bundle, nothing is written: the batch comes back as encoded tar members for the parent to append.
+    """
+    if bundle:
+        return b"".join([tar_member(path, blob) for task in tasks for path, blob in render_stock(task)])
+    for task in tasks:
+        for path, blob in render_stock(task):
+            write_html_bytes(path, blob)
+
+def scan(d: Path, want_dir: bool, suffix=""):
+    """Sub-dirs or files of d (optionally by suffix), using scandir's cached entry type."""
+    with os.scandir(d) as it:
+        return [Path(e.path) for e in it
+                if e.name.endswith(suffix) and (e.is_dir() if want_dir else e.is_file())]
+
+def list_files(root: Path):
+    """All files under root as POSIX paths relative to it (recursive os.scandir, no per-file stat)."""
+    out, stack = set(), [("", str(root))]
+    while stack:
+        prefix, d = stack.pop()
+        with os.scandir(d) as it:
+            for e in it:
+                if e.is_dir(follow_symlinks=False):
+                    stack.append((f"{prefix}{e.name}/", e.path))
+                else:
+                    out.add(f"{prefix}{e.name}")
+    return out
+
+def write_chunks(path: Path, chunks):
+    """Stream an iterable of byte chunks to path (joined into one member only for the tar bundle)."""
+    if TAR is not None:
+        write_html_bytes(path, b"".join(chunks))
+        return
+    with open(path, "wb") as f:
+        f.writelines(chunks)
+
+def _write_urlset(path: Path, urls):
+    # stream one encoded <url> at a time, no full-document string
+    write_chunks(path, chain(
+        [b"<?xml version='1.0' encoding='UTF-8'?>"
+         b"<urlset xmlns='http://www.sitemaps.org/schemas/sitemap/0.9'>"],
+        (f"<url><loc>{u}</loc></url>".encode("utf-8") for u in urls),
+        [b"</urlset>"],
+    ))
+
+def write_sitemaps(urls):
+    """Write sitemap.xml → file names written.
+
+    Past SITEMAP_MAX URLs, sitemap.xml becomes a sitemap index over sitemap-1.xml, sitemap-2.xml, ...
+    """
+    urls = sorted(set(urls))
+    if len(urls) <= SITEMAP_MAX:
+        _write_urlset(DIST / "sitemap.xml", urls)
+        return ["sitemap.xml"]
+    names = []
+    for k in range(0, len(urls), SITEMAP_MAX):
+        names.append(f"sitemap-{len(names) + 1}.xml")
+        _write_urlset(DIST / names[-1], urls[k:k + SITEMAP_MAX])
+    write_chunks(DIST / "sitemap.xml", chain(
+        [b"<?xml version='1.0' encoding='UTF-8'?>"
+         b"<sitemapindex xmlns='http://www.sitemaps.org/schemas/sitemap/0.9'>"],
+        (f"<sitemap><loc>{BASE_URL}/{n}</loc></sitemap>".encode("utf-8") for n in names),
+        [b"</sitemapindex>"],
+    ))
+    return ["sitemap.xml", *names]
 
 # ---------- Build ----------
-def main():
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Build the static site into dist/.")
+    ap.add_argument("--force", action="store_true", help="re-render every stock page, ignoring the build manifest")
+    ap.add_argument("--clean", action="store_true", help="wipe dist/ before building (implies --force)")
+    ap.add_argument("--bundle", action="store_true",
+                    help=f"write the whole site into {BUNDLE.name} instead of dist/ (always a full render)")
+    args = ap.parse_args(argv)
+    if not args.bundle:
+        build(args)
+        print("Build complete →", DIST)
+        return
+
+    global TAR
+    TAR, done = open(BUNDLE, "wb"), False
+    try:
+        build(args)
+        # end-of-archive: two zero blocks, padded to a full record like tarfile does
+        TAR.write(bytes(2 * tarfile.BLOCKSIZE))
+        TAR.write(bytes(-TAR.tell() % tarfile.RECORDSIZE))
+        done = True
+    finally:
+        TAR.close()
+        TAR = None
+        if not done:
+            BUNDLE.unlink(missing_ok=True)  # never leave a truncated archive behind
+    print("Build complete →", BUNDLE)
+
+def build(args):
+    """Render the site into dist/ (or into the open TAR bundle)."""
     date_dir, date_obj = find_latest_date_folder()
 
-    # reset dist
-    if DIST.exists():
-        shutil.rmtree(DIST)
-    (DIST / "static").mkdir(parents=True, exist_ok=True)
+    KNOWN_DIRS.clear()  # dist/ may have changed (or been wiped) since a previous in-process build
+    existing, old_manifest = set(), {}
+    if TAR is None:
+        # reset dist only on --clean; otherwise unchanged stock pages are kept (see manifest)
+        if args.clean and DIST.exists():
+            shutil.rmtree(DIST)
+        (DIST / "static").mkdir(parents=True, exist_ok=True)
+        existing = list_files(DIST)
+        if MANIFEST.exists() and not (args.force or args.clean):
+            old_manifest = json.loads(MANIFEST.read_text(encoding="utf-8"))
 
     # copy CSS (fallback if missing)
     css_src = ROOT / "static" / "styles.css"
-    if css_src.exists():
+    if css_src.exists() and TAR is not None:
+        write_html_bytes(DIST / "static" / "styles.css", css_src.read_bytes())
+    elif css_src.exists():
         shutil.copy2(css_src, DIST / "static" / "styles.css")
     else:
-        (DIST / "static" / "styles.css").write_text(
+        write_html(
+            DIST / "static" / "styles.css",
             "body{font-family:system-ui;background:#0b1220;color:#e8f0fe;margin:0}"
             " .container{max-width:1100px;margin:0 auto;padding:24px}"
             " .card{background:#111a2b;border-radius:16px;padding:16px}"
@@ -128,23 +509,22 @@ def main():
             " .grid{display:grid;gap:16px}"
             " .table{width:100%;border-collapse:collapse}"
             " .table td,.table th{border-bottom:1px solid #1f2a44;padding:8px}"
-            " .small{color:#9fb3c8}",
-            encoding="utf-8"
+            " .small{color:#9fb3c8}"
         )
 
     # Home: list regions discovered (exact folder names you upload)
-    regions = [p for p in date_dir.iterdir() if p.is_dir()]
+    regions = scan(date_dir, want_dir=True)
     regions.sort(key=lambda x: x.name.lower())
 
     home_body = ["<section class='card'><h2 class='h2'>Browse Regions</h2><ul>"]
     for r in regions:
         r_slug = slug(r.name)
-        home_body.append(f"<li><a href='{BASE_URL}/{r_slug}/index.html'>{r.name}</a></li>")
+        home_body.append(f"<li><a href='{BASE_URL}/{r_slug}/index.html'>{esc(r.name)}</a></li>")
     home_body.append("</ul></section>")
     write_html(
         DIST / "index.html",
         tpl_base(
-            f"{CFG.get('site_title','')} — {CFG.get('site_tagline','')}",
+            f"{_SITE_TITLE} — {esc(CFG.get('site_tagline',''))}",
             "Daily static stock prediction pages built from your uploaded CSVs.",
             "\n".join(home_body),
             f"{BASE_URL}/"
@@ -152,106 +532,54 @@ def main():
     )
 
     sitemap_urls = [f"{BASE_URL}/"]  # collect for sitemap
+    outputs = {"index.html", "robots.txt", "static/styles.css"}  # + sitemap files, known at the end
+    stock_tasks = {}  # stock dir → render task; duplicate slugs: the last row with OHLC wins
 
     # Region → Countries → Stocks
     for region in regions:
         r_slug = slug(region.name)
+        region_name = esc(region.name)
 
         # Collect countries (CSV files directly under region folder)
         country_links = []
-        for csv in sorted([p for p in region.glob("*.csv")], key=lambda x: x.name.lower()):
+        for csv_path in sorted(scan(region, want_dir=False, suffix=".csv"), key=lambda x: x.name.lower()):
             # country name from filename
-            country_name = csv.stem.replace("-", " ").title()
+            country_name = csv_path.stem.replace("-", " ").title()
             c_slug = slug(country_name)
+            country_name = esc(country_name)
             country_links.append((country_name, c_slug))
-
-            df = read_csv_safe(csv)
+            if TAR is None:
+                ensure_dir(DIST / r_slug / c_slug)
+
+            rows, ohlc = read_rows(csv_path)
+            valid = ~np.isnan(ohlc).any(axis=1)
+            sig, conf, reason = classify(*ohlc.T)
+            sig[~valid] = ""
+            columns = zip(rows, esc_rows(rows), valid.tolist(), ohlc.tolist(), sig.tolist(), conf.tolist(), reason.tolist())
             rows_html = []
-
-            for _, row in df.iterrows():
-                # read row values
-                try:
-                    o = float(row["open"]); h = float(row["high"]); l = float(row["low"]); c = float(row["close"])
-                except Exception:
-                    o = h = l = c = None
-
-                sig, conf, reason = ("", 0, "")
-                if None not in (o, h, l, c):
-                    sig, conf, reason = classify(o, h, l, c)
-
-                sym = str(row["symbol"]).strip()
-                name = str(row["description"]).strip() or sym
-                exch = str(row["exchange"]).strip()
-                sec  = str(row["sector"]).strip()
-                ind  = str(row["industry"]).strip()
-                s_slug = slug(name or sym)
-
-                # Per-stock page (only if we have OHLC)
-                if None not in (o, h, l, c):
-                    pred = next_business_day(date_obj)
-
-                    # Base stock page
-                    stock_body = f"""
-<article class="card">
-  <h2 class="h2">{name} ({sym})</h2>
-  <p class="small">Region: {region.name} · Country: {country_name} · Exchange: {exch}</p>
-  <p class="small">Session Date: {date_obj.isoformat()} · OHLC: O {o}, H {h}, L {l}, C {c}</p>
-  <div class="card">
-    <h3 class="h3">Prediction for {pred.isoformat()}</h3>
-    <p><strong>{sig}</strong> — {reason} (confidence {int(conf*100)}%).</p>
-  </div>
-</article>"""
-
-                    # Write main page
-                    stock_url = f"{BASE_URL}/{r_slug}/{c_slug}/{s_slug}/"
-                    write_html(
-                        DIST / r_slug / c_slug / s_slug / "index.html",
-                        tpl_base(
-                            f"{name} prediction tomorrow — {CFG.get('site_title','')}",
-                            f"{name} ({sym}) next-day prediction and OHLC snapshot.",
-                            stock_body,
-                            stock_url
-                        )
-                    )
-                    sitemap_urls.append(stock_url.rstrip("/"))
-
-                    # ---- SEO aliases ----
-                    # /prediction/
-                    alias1_url = f"{BASE_URL}/{r_slug}/{c_slug}/{s_slug}/prediction/"
-                    write_html(
-                        DIST / r_slug / c_slug / s_slug / "prediction" / "index.html",
-                        tpl_base(
-                            f"{name} prediction — {CFG.get('site_title','')}",
-                            f"{name} ({sym}) prediction based on yesterday’s OHLC.",
-                            stock_body,
-                            alias1_url
-                        )
-                    )
-                    sitemap_urls.append(alias1_url.rstrip("/"))
-
-                    # /tomorrow-prediction/
-                    alias2_url = f"{BASE_URL}/{r_slug}/{c_slug}/{s_slug}/tomorrow-prediction/"
-                    write_html(
-                        DIST / r_slug / c_slug / s_slug / "tomorrow-prediction" / "index.html",
-                        tpl_base(
-                            f"{name} tomorrow prediction — {CFG.get('site_title','')}",
-                            f"{name} ({sym}) forecast for the next trading day.",
-                            stock_body,
-                            alias2_url
-                        )
+            key_prefix = f"{r_slug}/{c_slug}"
+            link_prefix = f"{BASE_URL}/{key_prefix}"
+
+            # One pass per row: stock page task, sitemap URLs and country-table row share these locals
+            for raw, shown, ok, (o, h, l, c), s, cf, why in columns:
+                sym, name, exch, sec, ind, s_slug = parse_row(raw, shown)
+                stock_url = f"{link_prefix}/{s_slug}"
+
+                # Per-stock page (only if we have OHLC); rendered by the worker pool below
+                if ok:
+                    key = f"{key_prefix}/{s_slug}"
+                    stock_tasks[key] = (
+                        key, stock_url, sym, name, exch, o, h, l, c, s, cf, why,
+                        region_name, country_name, date_obj
                     )
-                    sitemap_urls.append(alias2_url.rstrip("/"))
+                    sitemap_urls += [stock_url, f"{stock_url}/prediction", f"{stock_url}/tomorrow-prediction"]
 
                 # Row in country table (links must use BASE_URL)
+                href = f"{stock_url}/index.html"
+                close = format(c, ".2f") if ok else ""
                 rows_html.append(
-                    (
-                        f"<tr>"
-                        f"<td><a href='{BASE_URL}/{r_slug}/{c_slug}/{s_slug}/index.html'>{sym}</a></td>"
-                        f"<td><a href='{BASE_URL}/{r_slug}/{c_slug}/{s_slug}/index.html'>{name}</a></td>"
-                        f"<td>{exch}</td><td>{sec}</td><td>{ind}</td>"
-                        f"<td>{'' if c is None else f'{c:.2f}'}</td><td>{sig}</td>"
-                        f"</tr>"
-                    )
+                    f"<tr><td><a href='{href}'>{sym}</a></td><td><a href='{href}'>{name}</a></td>"
+                    f"<td>{exch}</td><td>{sec}</td><td>{ind}</td><td>{close}</td><td>{s}</td></tr>"
                 )
 
             # Country index page
@@ -266,12 +594,13 @@ def main():
             write_html(
                 DIST / r_slug / c_slug / "index.html",
                 tpl_base(
-                    f"{country_name} stocks — {CFG.get('site_title','')}",
+                    f"{country_name} stocks — {_SITE_TITLE}",
                     f"Browse stocks listed in {country_name}.",
                     body,
                     country_url
                 )
             )
+            outputs.add(f"{r_slug}/{c_slug}/index.html")
             sitemap_urls.append(country_url.rstrip("/"))
 
         # Region index page (links must use BASE_URL)
@@ -279,34 +608,53 @@ def main():
             [f"<li><a href='{BASE_URL}/{r_slug}/{c_slug}/index.html'>{cn}</a></li>"
              for (cn, c_slug) in country_links]
         )
-        body = f"<section class='card'><h2 class='h2'>Countries in {region.name}</h2><ul>{lis}</ul></section>"
+        body = f"<section class='card'><h2 class='h2'>Countries in {region_name}</h2><ul>{lis}</ul></section>"
         region_url = f"{BASE_URL}/{r_slug}/"
         write_html(
             DIST / r_slug / "index.html",
             tpl_base(
-                f"{region.name} Markets — {CFG.get('site_title','')}",
-                f"Browse stock markets in {region.name}.",
+                f"{region_name} Markets — {_SITE_TITLE}",
+                f"Browse stock markets in {region_name}.",
                 body,
                 region_url
             )
         )
+        outputs.add(f"{r_slug}/index.html")
         sitemap_urls.append(region_url.rstrip("/"))
 
-    # robots.txt + sitemap.xml
-    (DIST / "robots.txt").write_text(
-        f"Sitemap: {BASE_URL}/sitemap.xml\nUser-agent: *\nAllow: /\n",
-        encoding="utf-8"
-    )
-
-    sm = (
-        "<?xml version='1.0' encoding='UTF-8'?>"
-        "<urlset xmlns='http://www.sitemaps.org/schemas/sitemap/0.9'>"
-        + "".join([f"<url><loc>{u}</loc></url>" for u in sorted(set(sitemap_urls))])
-        + "</urlset>"
-    )
-    (DIST / "sitemap.xml").write_text(sm, encoding="utf-8")
+    # Stock pages: skip those whose inputs are unchanged, render the rest in worker processes
+    manifest, tasks = {}, []
+    for key, task in stock_tasks.items():
+        manifest[key] = stock_hash(task)
+        pages = [f"{key}/{p}" for p in STOCK_PAGES]
+        outputs.update(pages)
+        if old_manifest.get(key) == manifest[key] and existing.issuperset(pages):
+            continue
+        tasks.append(task)
+    batches = [tasks[k:k + BATCH] for k in range(0, len(tasks), BATCH)]
+    with ProcessPoolExecutor(max_workers=os.cpu_count()) as executor:
+        for members in executor.map(render_batch, batches, repeat(args.bundle)):
+            if members:
+                TAR.write(members)
 
-    print("Build complete →", DIST)
+    # robots.txt + sitemap.xml
+    write_html(DIST / "robots.txt", f"Sitemap: {BASE_URL}/sitemap.xml\nUser-agent: *\nAllow: /\n")
+    outputs.update(write_sitemaps(sitemap_urls))
+
+    if TAR is not None:
+        return
+
+    # Drop pages this build no longer produces (e.g. delisted stocks) and their empty dirs
+    for rel in existing - outputs:
+        path = DIST / rel
+        path.unlink()
+        parent = path.parent
+        while parent != DIST and not any(parent.iterdir()):
+            parent.rmdir()
+            KNOWN_DIRS.discard(parent)
+            parent = parent.parent
+    MANIFEST.parent.mkdir(parents=True, exist_ok=True)
+    MANIFEST.write_text(json.dumps(manifest), encoding="utf-8")
 
 if __name__ == "__main__":
     main()